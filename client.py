@@ -1,11 +1,27 @@
 import asyncio
-import json
 import websockets
 from blessed import Terminal
-from typing import Dict, List
+from typing import Dict, List, Set, Tuple
 from dotenv import load_dotenv
 import os
+import socket
 import sys
+import time
+
+try:
+    import orjson
+    loads, dumps = orjson.loads, orjson.dumps
+except ImportError:
+    import json
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj).encode()
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 load_dotenv()
 
@@ -27,82 +43,169 @@ VERTICAL_WALL = "║"
 BOTTOM_LEFT_CORNER = "╚═"
 BOTTOM_RIGHT_CORNER = "═╝"
 
-class Pos:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+# Movement keys and the message each step sends, encoded once up front.
+KEY_STEPS = {"w": (0, -1), "s": (0, 1), "a": (-1, 0), "d": (1, 0)}
+MOVE_MESSAGES = {
+    (0, -1): dumps({"type": "move", "dir": "up"}),
+    (0, 1): dumps({"type": "move", "dir": "down"}),
+    (-1, 0): dumps({"type": "move", "dir": "left"}),
+    (1, 0): dumps({"type": "move", "dir": "right"}),
+}
+
+UNDRAWN = 0xFF
+# Upper bound on a blocking inkey() in the input thread, so it exits promptly on quit.
+INPUT_TIMEOUT = 0.1
+# Minimum time between two redraws; state received in between is coalesced.
+FRAME_INTERVAL = 1 / 60
+# The init message lists every wall, so leave headroom above typical map sizes.
+MAX_MESSAGE_SIZE = 2 ** 20
+# Moves are sent in the background; at most this many are in flight at once.
+MAX_PENDING_SENDS = 8
+
+# Tile positions are packed into a single int as (y << 16) | x.
+COORD_SHIFT = 16
+COORD_MASK = (1 << COORD_SHIFT) - 1
+
+def pack_coord(x, y):
+    return (y << COORD_SHIFT) | x
 
 class Tile:
-    def __init__(self, symbol, walkable, pos: Pos, term: Terminal):
+    # Color callables are resolved once per Terminal by GameClient; blessed
+    # looks them up through __getattr__ on every access otherwise.
+    _COLOR = None
+
+    __slots__ = ("symbol", "walkable", "coord", "term", "_cached")
+
+    def __init__(self, symbol, walkable, coord: int, term: Terminal):
         self.symbol = symbol
         self.walkable = walkable
-        self.pos = pos
+        self.coord = coord
         self.term = term
-        print(self, end="", flush=True)
+        self._cached: Tuple[str, str] | None = None
 
     def _render(self, color=None, custom_symbol=None):
-        color = color or self.term.white
+        color = color or self._COLOR
         custom_symbol = custom_symbol or self.symbol
-        return self.term.move_xy(self.pos.x * 2, self.pos.y) + color(custom_symbol) + self.term.normal
+        return color, custom_symbol
 
-    def __str__(self):
+    def render(self):
         return self._render()
 
+    def glyph(self):
+        # (color, symbol) without cursor positioning, so it survives moves.
+        if self._cached is None:
+            self._cached = self.render()
+        return self._cached
+
+    def move_to(self, x, y):
+        self.coord = pack_coord(x, y)
+
 class Wall(Tile):
-    def __init__(self, pos, term: Terminal):
-        super().__init__("▒▒", False, pos, term)
+    __slots__ = ()
 
-    def __str__(self):
-        return self._render(color=self.term.grey37)
+    def __init__(self, coord, term: Terminal):
+        super().__init__("▒▒", False, coord, term)
+
+    def render(self):
+        return self._render(color=self._COLOR)
 
 class Empty(Tile):
-    def __init__(self, pos, term: Terminal):
-        super().__init__("  ", True, pos, term)
+    __slots__ = ()
+
+    def __init__(self, coord, term: Terminal):
+        super().__init__("  ", True, coord, term)
 
-    def __str__(self):
-        return self._render(color=self.term.on_darkolivegreen)
+    def render(self):
+        return self._render(color=self._COLOR)
 
 class Player(Tile):
-    def __init__(self, pos, term: Terminal, is_self=False):
+    __slots__ = ("is_self",)
+
+    def __init__(self, coord, term: Terminal, is_self=False):
         self.is_self = is_self
-        super().__init__(BLOCK * 2, True, pos, term)
+        super().__init__(BLOCK * 2, True, coord, term)
 
-    def __str__(self):
-        color = self.term.cyan2 if self.is_self else self.term.orange4
-        return self._render(color=color)
+    def render(self):
+        return self._render(color=self._COLOR_SELF if self.is_self else self._COLOR_OTHER)
 
     async def move(self, dx, dy, map: List[List[Tile]], ws: websockets.ClientConnection):
-        new_x, new_y = self.pos.x + dx, self.pos.y + dy
+        new_x, new_y = (self.coord & COORD_MASK) + dx, (self.coord >> COORD_SHIFT) + dy
         tile = map[new_y][new_x]
         if tile.walkable:
-            await ws.send(json.dumps({"type": "move", "dir": "up" if dy < 0 else "down" if dy > 0 else "left" if dx < 0 else "right"}))
+            await ws.send(MOVE_MESSAGES[dx, dy], text=True)
 
 
 
 class Enemy(Tile):
-    def __init__(self, pos, term: Terminal):
-        super().__init__(BLOCK * 2, True, pos, term)
+    __slots__ = ()
 
-    def __str__(self):
-            return self._render(color=self.term.red)
+    def __init__(self, coord, term: Terminal):
+        super().__init__(BLOCK * 2, True, coord, term)
+
+    def render(self):
+        return self._render(color=self._COLOR)
 
 
 class Treasure(Tile):
-    def __init__(self, pos, term: Terminal, collected=False):
+    __slots__ = ("collected",)
+
+    def __init__(self, coord, term: Terminal, collected=False):
         self.collected = collected
-        super().__init__(BLOCK * 2, True, pos, term)
+        super().__init__(BLOCK * 2, True, coord, term)
 
-    def __str__(self):
-        return self._render(color=self.term.gold if not self.collected else self.term.gray)
+    def render(self):
+        return self._render(color=self._COLOR_GONE if self.collected else self._COLOR_OK)
 class Exit(Tile):
-    def __init__(self, pos, term: Terminal):
-        super().__init__("XX", True, pos, term)
+    __slots__ = ()
+
+    def __init__(self, coord, term: Terminal):
+        super().__init__("XX", True, coord, term)
+
+
+def _render_frame(screen, frame, width, glyphs, moves, out):
+    # Changed cells are written per row as runs: one cursor move per contiguous
+    # stretch and one color on/off per same-colored group. render_frame.pyx is
+    # the compiled version of this loop and must stay in step with it.
+    for base in range(0, len(frame), width):
+        end = base + width
+        # Most rows are untouched; a C-level slice compare skips them whole.
+        if frame[base:end] == screen[base:end]:
+            continue
+        contiguous = False
+        i = base
+        while i < end:
+            if frame[i] == screen[i]:
+                contiguous = False
+                i += 1
+                continue
+            if not contiguous:
+                out += moves[i]
+                contiguous = True
+            on, _, off = glyphs[frame[i]]
+            out += on
+            while i < end and frame[i] != screen[i] and glyphs[frame[i]][0] == on:
+                out += glyphs[frame[i]][1]
+                i += 1
+            out += off
+
+try:
+    from render_frame import render_frame
+except ImportError:
+    render_frame = _render_frame
 
 
 class GameClient:
     def __init__(self, uri):
         self.uri = uri
         self.term = Terminal()
+        Tile._COLOR = self.term.white
+        Wall._COLOR = self.term.grey37
+        Empty._COLOR = self.term.on_darkolivegreen
+        Player._COLOR_SELF = self.term.cyan2
+        Player._COLOR_OTHER = self.term.orange4
+        Enemy._COLOR = self.term.red
+        Treasure._COLOR_OK = self.term.gold
+        Treasure._COLOR_GONE = self.term.gray
         self.map: List[List[Tile]] = []
         self.players: Dict[str, Player] = {}
         self.enemies: Dict[str, Enemy] = {}
@@ -111,87 +214,173 @@ class GameClient:
         self.map_size = (0, 0)
         self.player: Player | None = None
         self.player_id = None
+        self._encoding = sys.stdout.encoding or "utf-8"
+        self._glyphs: List[Tuple[bytes, bytes, bytes]] = []
+        self._glyph_ids: Dict[Tuple[str, str], int] = {}
+        self._terrain = bytearray()
+        self._screen = bytearray()
+        self._moves: List[bytes] = []
+        self._needs_draw = False
+        self._last_draw = 0.0
+        self._pending_sends: Set[asyncio.Task] = set()
+        self._send_slots = asyncio.Semaphore(MAX_PENDING_SENDS)
 
     async def connect(self):
-        async with websockets.connect(self.uri) as ws:
+        # Payloads are small JSON documents: compression costs more CPU than it
+        # saves, and move messages should not wait on Nagle's algorithm.
+        async with websockets.connect(self.uri, compression=None, max_size=MAX_MESSAGE_SIZE, max_queue=32) as ws:
+            sock = ws.transport.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             await self.main_loop(ws)
 
     async def main_loop(self, ws: websockets.ClientConnection):
-        print(self.term.home + self.term.clear)
+        loop = asyncio.get_running_loop()
         with self.term.fullscreen(), self.term.hidden_cursor(), self.term.cbreak():
+            # Network and keyboard are awaited concurrently; the loop only wakes
+            # up when one of them actually has something for us.
+            recv_task = asyncio.create_task(ws.recv(decode=False))
+            key_task = loop.run_in_executor(None, self.term.inkey, INPUT_TIMEOUT)
             while True:
-                try:
-                    message = await asyncio.wait_for(ws.recv(), timeout=0.05)
-                    data = json.loads(message)
-                    if data["type"] == "init":
-                        self.handle_init(data)
-                    elif data["type"] == "state":
-                        self.handle_state(data)
-                except asyncio.TimeoutError:
-                    pass
-
-                key = self.term.inkey(timeout=0.01)
-                if key.lower() == "q":
-                    await ws.close()
-                    sys.exit(0)
-                if key and self.player:
-                    if key.lower() == "w":
-                        await self.player.move(0, -1, self.map, ws)
-                    elif key.lower() == "s":
-                        await self.player.move(0, 1, self.map, ws)
-                    elif key.lower() == "a":
-                        await self.player.move(-1, 0, self.map, ws)
-                    elif key.lower() == "d":
-                        await self.player.move(1, 0, self.map, ws)
+                timeout = None
+                if self._needs_draw:
+                    timeout = max(0.0, self._last_draw + FRAME_INTERVAL - time.monotonic())
+                done, _ = await asyncio.wait((recv_task, key_task), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                received = recv_task in done
+                if received:
+                    self.handle_message(recv_task.result())
+                    recv_task = asyncio.create_task(ws.recv(decode=False))
+
+                if key_task in done:
+                    key = key_task.result().lower()
+                    if key == "q":
+                        if self._pending_sends:
+                            await asyncio.wait(self._pending_sends)
+                        await ws.close()
+                        sys.exit(0)
+                    step = KEY_STEPS.get(key)
+                    if step and self.player:
+                        self.send_soon(self.player.move(*step, self.map, ws))
+                    key_task = loop.run_in_executor(None, self.term.inkey, INPUT_TIMEOUT)
+
+                # Keep applying messages while they are already queued and only
+                # redraw once the burst is drained and the frame interval is up.
+                if self._needs_draw and not received and time.monotonic() - self._last_draw >= FRAME_INTERVAL:
+                    self.draw()
+
+    def send_soon(self, send):
+        # Run the send in the background so a slow socket never holds up
+        # receiving or drawing; keep a reference until it finishes.
+        task = asyncio.create_task(self._send(send))
+        self._pending_sends.add(task)
+        task.add_done_callback(self._pending_sends.discard)
+
+    async def _send(self, send):
+        async with self._send_slots:
+            try:
+                await send
+            except websockets.ConnectionClosed:
+                # The receive side reports the closed connection.
+                pass
+
+    def handle_message(self, message):
+        data = loads(message)
+        if data["type"] == "init":
+            self.handle_init(data)
+            self._needs_draw = True
+        elif data["type"] == "state":
+            self.handle_state(data)
+            self._needs_draw = True
 
     def handle_init(self, data):
         self.map_size = (data["width"], data["height"])
-        self.map = [[Empty(Pos(x, y), self.term) for x in range(data["width"])] for y in range(data["height"])]
+        self.map = [[Empty(pack_coord(x, y), self.term) for x in range(data["width"])] for y in range(data["height"])]
         for wall in data["walls"]:
             x, y = wall["x"], wall["y"]
-            self.map[y][x] = Wall(Pos(x, y), self.term)
+            self.map[y][x] = Wall(pack_coord(x, y), self.term)
         if "exit" in data:
             x, y = data["exit"]["x"], data["exit"]["y"]
-            self.exit = Exit(Pos(x, y), self.term)
+            self.exit = Exit(pack_coord(x, y), self.term)
             self.map[y][x] = self.exit
+        self._terrain = bytearray(self._glyph_id(tile) for row in self.map for tile in row)
+        self._screen = bytearray([UNDRAWN]) * len(self._terrain)
+        width = data["width"]
+        self._moves = [
+            self.term.move_xy(i % width * 2, i // width).encode(self._encoding)
+            for i in range(len(self._terrain))
+        ]
 
     def handle_state(self, data):
         self.player_id = data.get("you")
 
         for pid, pos in data["players"].items():
             if pid in self.players:
-                player = self.players[pid]
-                self.map[player.pos.y][player.pos.x] = Empty(player.pos, self.term)
-                player.pos.x = pos["x"]
-                player.pos.y = pos["y"]
-                print(player, end="", flush=True)
+                self.players[pid].move_to(pos["x"], pos["y"])
             else:
-                tile = Player(Pos(pos["x"], pos["y"]), self.term, is_self=(pid == self.player_id))
-                self.players[pid] = tile
-                self.map[pos["y"]][pos["x"]] = tile
+                self.players[pid] = Player(pack_coord(pos["x"], pos["y"]), self.term, is_self=(pid == self.player_id))
+        for pid in self.players.keys() - data["players"].keys():
+            del self.players[pid]
 
         self.player = self.players.get(self.player_id)
 
         for eid, pos in data["enemies"].items():
             if eid in self.enemies:
-                enemy = self.enemies[eid]
-                self.map[enemy.pos.y][enemy.pos.x] = Empty(enemy.pos, self.term)
-                enemy.pos.x = pos["x"]
-                enemy.pos.y = pos["y"]
-                print(enemy, end="", flush=True)
+                self.enemies[eid].move_to(pos["x"], pos["y"])
             else:
-                enemy = Enemy(Pos(pos["x"], pos["y"]), self.term)
-                self.enemies[eid] = enemy
-
+                self.enemies[eid] = Enemy(pack_coord(pos["x"], pos["y"]), self.term)
+        for eid in self.enemies.keys() - data["enemies"].keys():
+            del self.enemies[eid]
 
         if "treasure" in data:
             t = data["treasure"]
-            self.treasure = Treasure(Pos(t["x"], t["y"]), self.term, collected=t.get("collected", False))
-            self.map[t["y"]][t["x"]] = self.treasure
+            collected = t.get("collected", False)
+            current = self.treasure
+            coord = pack_coord(t["x"], t["y"])
+            if current is None or (current.coord, current.collected) != (coord, collected):
+                self.treasure = Treasure(coord, self.term, collected=collected)
+
+    def _glyph_id(self, tile: Tile) -> int:
+        glyph = tile.glyph()
+        gid = self._glyph_ids.get(glyph)
+        if gid is None:
+            # Stored pre-encoded as (color on, symbol, color off) for draw().
+            color, symbol = glyph
+            gid = self._glyph_ids[glyph] = len(self._glyphs)
+            self._glyphs.append((
+                color.encode(self._encoding),
+                symbol.encode(self._encoding),
+                self.term.normal.encode(self._encoding) if color else b"",
+            ))
+        return gid
+
+    def draw(self):
+        # The screen is a flat y * width + x array of glyph ids: start from the
+        # static terrain, stamp the entities on top and only write out the cells
+        # that differ from what is already on the terminal.
+        self._needs_draw = False
+        self._last_draw = time.monotonic()
+        if not self._terrain:
+            return
+        width = self.map_size[0]
+        frame = self._terrain[:]
+        for tile in (self.treasure, *self.enemies.values(), *self.players.values()):
+            if tile is not None:
+                frame[(tile.coord >> COORD_SHIFT) * width + (tile.coord & COORD_MASK)] = self._glyph_id(tile)
+
+        out = bytearray()
+        render_frame(self._screen, frame, width, self._glyphs, self._moves, out)
+        self._screen = frame
+        if out:
+            # One write for the whole frame; the buffered writer hands a buffer
+            # this size straight to the OS.
+            sys.stdout.buffer.write(out)
+            sys.stdout.buffer.flush()
 
 if __name__ == "__main__":
     try:
         client = GameClient(SERVER_URI)
-        asyncio.run(client.connect())
+        run = uvloop.run if uvloop is not None else asyncio.run
+        run(client.connect())
     except KeyboardInterrupt:
         print("Disconnected.")
@@ -0,0 +1,32 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# Compiled version of client._render_frame; build with `cythonize -i render_frame.pyx`.
+from libc.string cimport memcmp
+
+
+def render_frame(const unsigned char[::1] screen, const unsigned char[::1] frame, Py_ssize_t width,
+                 list glyphs, list moves, bytearray out):
+    cdef Py_ssize_t n = frame.shape[0]
+    cdef Py_ssize_t base, end, i
+    cdef bint contiguous
+    cdef bytes on, off
+
+    for base in range(0, n, width):
+        end = base + width
+        if memcmp(&frame[base], &screen[base], width) == 0:
+            continue
+        contiguous = False
+        i = base
+        while i < end:
+            if frame[i] == screen[i]:
+                contiguous = False
+                i += 1
+                continue
+            if not contiguous:
+                out += <bytes>moves[i]
+                contiguous = True
+            on, _, off = glyphs[frame[i]]
+            out += on
+            while i < end and frame[i] != screen[i] and (<tuple>glyphs[frame[i]])[0] == on:
+                out += (<tuple>glyphs[frame[i]])[1]
+                i += 1
+            out += off